@@ -1,23 +1,60 @@
 import os
+import asyncio
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import aiohttp
 import discord
 from discord.ext import tasks, commands
 
+from sqlalchemy import or_, select, update
 from sqlalchemy.sql.expression import false
 from sqlalchemy.exc import IntegrityError, PendingRollbackError
 
 from dotenv import load_dotenv
 
-from models import Author, Article, BannedUser, session
+from models import Author, Article, BannedUser, Session
 
-from embeds import help_message, new_article_message
+from embeds import HELP_EMBED, new_article_message
 
 # Export .env file.
 load_dotenv(".env")
 
 
+async def _fetch_feed(session, url, etag=None, last_modified=None):
+    """
+    Download the raw bytes of an XML feed without blocking the event loop.
+
+    Sends any cached validators as a conditional GET and returns a tuple of
+    (feed, etag, last_modified), where feed is None if it hasn't changed.
+    Raises aiohttp.ClientResponseError for any other status than 200 or 304.
+    """
+    headers = {}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            return None, etag, last_modified
+
+        if response.status != 200:
+            raise aiohttp.ClientResponseError(
+                response.request_info,
+                response.history,
+                status=response.status,
+                message=response.reason,
+                headers=response.headers,
+            )
+
+        return (
+            await response.read(),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+
 class SubstackBot(discord.Client):
     """
     Bot handles adding and removing posts and runs a job every 5 minutes
@@ -27,16 +64,64 @@ class SubstackBot(discord.Client):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # Shared HTTP session for fetching feeds, created once connected.
+        self.feed_session = None
+
+        # Resolve settings once rather than on every use.
+        self._channel_id = int(os.getenv("CHANNEL_ID"))
+        self._oldest_days = int(os.getenv("OLDEST_POST_DELTA"))
+        self._owner = os.getenv("BOT_OWNER")
+
+        # Main channel, fetched once connected.
+        self.channel = None
+
+        # Banned usernames, kept in step with the DB by !ban and !unban.
+        with Session() as session:
+            self._banned = {u.discord_username for u in session.query(BannedUser).all()}
+
+        # Subscribed authors, loaded on connect and kept in step with the DB
+        # by !subscribe and !unsubscribe.
+        self._authors = []
+
+        # Command handlers, looked up by the first word of a message.
+        self._commands = {
+            "!help": self._cmd_help,
+            "!list": self._cmd_list,
+            "!subscribe": self._cmd_subscribe,
+            "!unsubscribe": self._cmd_unsubscribe,
+            "!ban": self._cmd_ban,
+            "!unban": self._cmd_unban,
+            "!exit": self._cmd_exit,
+        }
+
+        # Commands banned users can't run, and those only the owner can.
+        self._restricted_commands = {
+            "!subscribe",
+            "!unsubscribe",
+            "!ban",
+            "!unban",
+            "!exit",
+        }
+        self._owner_commands = {"!ban", "!unban", "!exit"}
+
     async def on_ready(self):
         """
         Run startup tasks when job has connected to Discord.
         """
         self.console_log(f"Logged in as {super().user.name}.")
 
+        if self.feed_session is None:
+            self.feed_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20)
+            )
+
         # Fetch main channel.
-        self.channel_id = super().get_channel(int(os.getenv("CHANNEL_ID")))
+        self.channel = self.get_channel(self._channel_id)
         self.console_log("Connected to channel.")
 
+        with Session() as session:
+            self._authors = session.execute(select(Author)).scalars().all()
+
         # Schedule jobs.
         self.update_articles.start()
         self.post_articles.start()
@@ -44,187 +129,235 @@ class SubstackBot(discord.Client):
 
     async def on_message(self, message):
         """
-        Handle commands from users. Return after each command to prevent
-        fallthrough.
+        Dispatch commands from users to their handlers. Ordinary chat is
+        ignored before any parsing or DB work happens.
         """
-        cmd = message.content.split(" ")
+        if not message.content.startswith("!"):
+            return
 
-        # Try to parse requested Substack subdomain.
-        try:
-            subdomain = cmd[1]
-        except IndexError:
-            subdomain = None
+        # Only the command and its first argument are ever used.
+        cmd, _, rest = message.content.partition(" ")
 
-        # Post commands list.
-        if cmd[0] == "!help":
-            return await message.channel.send(embed=help_message())
+        handler = self._commands.get(cmd)
+        if handler is None:
+            return
 
-        # Get list of all authors subscribed to.
-        if cmd[0] == "!list":
+        # Try to parse requested Substack subdomain or username.
+        arg = rest.split(" ", 1)[0] if rest else None
 
-            subs = [(a.username, a.subdomain) for a in session.query(Author).all()]
+        if cmd in self._restricted_commands:
 
-            msg = f"Subscriptions:{os.linesep}"
-            for sub in subs:
-                msg += f"{sub[0]} // {sub[1]}{os.linesep}"
+            # Don't allow banned users to manage subscriptions.
+            if str(message.author) in self._banned:
+                return await message.channel.send(
+                    "Command is off limits to banned users."
+                )
 
-            return await message.channel.send(msg)
+            # Require owner for these commands.
+            caller_is_owner = str(message.author) == self._owner
+            if cmd in self._owner_commands and not caller_is_owner:
+                return
 
-        # Don't allow banned users past this point.
-        ban_list = [usr.discord_username for usr in session.query(BannedUser).all()]
-        if message.author in ban_list:
-            return await message.channel.send("Command is off limits to banned users.")
+        return await handler(message, arg)
 
-        # Add subscription.
-        if cmd[0] == "!subscribe":
+    async def _cmd_help(self, message, arg):
+        """
+        Post commands list.
+        """
+        return await message.channel.send(embed=HELP_EMBED)
 
-            # Badly formed arguments.
-            if subdomain is None:
-                msg = (
-                    "Please enter an author to subscribe to."
-                    " Alternatively, use !help for help."
-                )
-                self.console_log(
-                    f"{message.author} !subscribe {subdomain} - BADLY FORMED ARGUMENT"
-                )
+    async def _cmd_list(self, message, arg):
+        """
+        Get list of all authors subscribed to.
+        """
+        with Session() as session:
+            subs = session.execute(select(Author.username, Author.subdomain)).all()
 
-            else:
-                # Try to add the subscription.
+        msg = f"Subscriptions:{os.linesep}" + os.linesep.join(
+            f"{username} // {subdomain}" for username, subdomain in subs
+        )
+
+        return await message.channel.send(msg)
+
+    async def _cmd_subscribe(self, message, subdomain):
+        """
+        Add subscription.
+        """
+        # Badly formed arguments.
+        if subdomain is None:
+            msg = (
+                "Please enter an author to subscribe to."
+                " Alternatively, use !help for help."
+            )
+            self.console_log(
+                f"{message.author} !subscribe {subdomain} - BADLY FORMED ARGUMENT"
+            )
+
+        else:
+            # Try to add the subscription.
+            try:
+                # An unreachable feed fails validation like an invalid one.
                 try:
-                    a = Author(subdomain)
-                    msg = f"Subscribed to {a.username}."
-                    self.console_log(
-                        f"{message.author} !subscribe {subdomain} - SUCCESS"
+                    feed, _, _ = await _fetch_feed(
+                        self.feed_session, f"https://{subdomain}.substack.com/feed"
                     )
-
-                # Author already in DB.
-                except IntegrityError as e:
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    feed = None
+
+                a = Author(subdomain, feed)
+                with Session.begin() as session:
+                    session.add(a)
+                self._authors.append(a)
+                msg = f"Subscribed to {a.username}."
+                self.console_log(f"{message.author} !subscribe {subdomain} - SUCCESS")
+
+            # Author already in DB.
+            except IntegrityError as e:
+                # Conflict may be on the subdomain or on the username.
+                with Session() as session:
                     q = (
                         session.query(Author)
-                        .filter(Author.subdomain == subdomain)
+                        .filter(
+                            or_(
+                                Author.subdomain == subdomain,
+                                Author.username == a.username,
+                            )
+                        )
                         .first()
                     )
+
+                if q is not None:
                     msg = f"Already subscribed to {q.username}."
                     self.console_log(
                         f"{message.author} !subscribe {subdomain} - INTEGRITY ERROR"
                     )
 
-                # Author constructor raises ValueError if not a real author on Substack.
-                except ValueError as e:
-                    msg = str(e)
-                    self.console_log(
-                        f"{message.author} !subscribe {subdomain} - BAD REQUEST"
-                    )
-
-                # Something went wrong.
-                except Exception as e:
+                # Not a conflict with an existing author, something went wrong.
+                else:
                     msg = str(e)
                     self.console_log(f"{message.author} !subscribe {subdomain} - ERROR")
 
-            return await message.channel.send(msg)
-
-        # Remove subscription.
-        if cmd[0] == "!unsubscribe":
-
-            # Badly formed arguments.
-            if subdomain is None:
-                msg = (
-                    "Please enter an author to unsubcribe from."
-                    " Alternatively, use !help for help."
-                )
+            # Author constructor raises ValueError if not a real author on Substack.
+            except ValueError as e:
+                msg = str(e)
                 self.console_log(
-                    f"{message.author} !subscribe {subdomain} - BADLY FORMED ARGUMENT"
+                    f"{message.author} !subscribe {subdomain} - BAD REQUEST"
                 )
-            else:
-                # Try to remove the subscription.
-                try:
-                    q = session.query(Author).filter(Author.subdomain == cmd[1])
-                    a = q.first()
 
+            # Something went wrong.
+            except Exception as e:
+                msg = str(e)
+                self.console_log(f"{message.author} !subscribe {subdomain} - ERROR")
+
+        return await message.channel.send(msg)
+
+    async def _cmd_unsubscribe(self, message, subdomain):
+        """
+        Remove subscription.
+        """
+        # Badly formed arguments.
+        if subdomain is None:
+            msg = (
+                "Please enter an author to unsubcribe from."
+                " Alternatively, use !help for help."
+            )
+            self.console_log(
+                f"{message.author} !subscribe {subdomain} - BADLY FORMED ARGUMENT"
+            )
+        else:
+            # Try to remove the subscription.
+            try:
+                with Session.begin() as session:
+                    q = session.query(Author).filter(Author.subdomain == subdomain)
+                    a = q.first()
                     if a is not None:
                         session.delete(a)
-                        session.commit()
-                        msg = f"Unsubscribed from {a.username}."
-                        self.console_log(
-                            f"{message.author} !unsubscribe {a.subdomain} - SUCCESS"
-                        )
-                    else:
-                        msg = f"No subscription to '{cmd[1]}' found."
-                        self.console_log(
-                            f"{message.author} !unsubscribe {subdomain} - BAD REQUEST"
-                        )
-
-                # Couldn't find author on Substack.
-                except ValueError as e:
-                    msg = str(e)
-                    # User requested an author that didn't exist, set timeout.
-                    if "Unable to find author" in msg:
-                        self.console_log(
-                            f"{message.author} !subscribe {subdomain} - BAD REQUEST"
-                        )
 
-                # Something went wrong.
-                except Exception as e:
-                    msg = str(e)
+                if a is not None:
+                    self._authors = [x for x in self._authors if x.id != a.id]
+                    msg = f"Unsubscribed from {a.username}."
                     self.console_log(
-                        f"{message.author} !unsubscribe {subdomain} - ERROR"
+                        f"{message.author} !unsubscribe {a.subdomain} - SUCCESS"
+                    )
+                else:
+                    msg = f"No subscription to '{subdomain}' found."
+                    self.console_log(
+                        f"{message.author} !unsubscribe {subdomain} - BAD REQUEST"
                     )
 
-            return await message.channel.send(msg)
-
-        # Require owner for these commands:
-        caller_is_owner = str(message.author) == os.getenv("BOT_OWNER")
-
-        # Add user to banlist.
-        if cmd[0] == "!ban" and caller_is_owner:
-
-            # Badly formed argument.
-            if len(cmd) < 1:
-                msg = "Enter Discord username to ban."
-                self.console_log(f"{message.author}: !ban - BAD REQUEST")
-            else:
-                try:
-                    usr = BannedUser(cmd[1])
-                    msg = f"Added {cmd[1]} to list of banned users."
-                    self.console_log(f"{message.author}: !ban {cmd[1]} - SUCCESS")
-                except Exception as e:
-                    msg = f"{cmd[1]} is already banned."
+            # Couldn't find author on Substack.
+            except ValueError as e:
+                msg = str(e)
+                # User requested an author that didn't exist, set timeout.
+                if "Unable to find author" in msg:
                     self.console_log(
-                        f"{message.author}: !ban {cmd[1]} - INTEGRITY ERROR"
+                        f"{message.author} !subscribe {subdomain} - BAD REQUEST"
                     )
 
-            return await message.channel.send(msg)
+            # Something went wrong.
+            except Exception as e:
+                msg = str(e)
+                self.console_log(f"{message.author} !unsubscribe {subdomain} - ERROR")
 
-        # Remove user from banlist.
-        if cmd[0] == "!unban" and caller_is_owner:
+        return await message.channel.send(msg)
 
-            # Badly formed argument.
-            if len(cmd) < 1:
-                msg = "Enter Discord username to unban."
-                self.console_log(f"{message.author}: !unban - BAD REQUEST")
-            else:
+    async def _cmd_ban(self, message, username):
+        """
+        Add user to banlist.
+        """
+        # Badly formed argument.
+        if username is None:
+            msg = "Enter Discord username to ban."
+            self.console_log(f"{message.author}: !ban - BAD REQUEST")
+        else:
+            try:
+                usr = BannedUser(username)
+                with Session.begin() as session:
+                    session.add(usr)
+                self._banned.add(usr.discord_username)
+                msg = f"Added {username} to list of banned users."
+                self.console_log(f"{message.author}: !ban {username} - SUCCESS")
+            except Exception as e:
+                msg = f"{username} is already banned."
+                self.console_log(f"{message.author}: !ban {username} - INTEGRITY ERROR")
+
+        return await message.channel.send(msg)
+
+    async def _cmd_unban(self, message, username):
+        """
+        Remove user from banlist.
+        """
+        # Badly formed argument.
+        if username is None:
+            msg = "Enter Discord username to unban."
+            self.console_log(f"{message.author}: !unban - BAD REQUEST")
+        else:
+            with Session.begin() as session:
                 q = (
                     session.query(BannedUser)
-                    .filter(BannedUser.discord_username == cmd[1])
+                    .filter(BannedUser.discord_username == username)
                     .first()
                 )
-
-                # User wasn't banned.
-                if q is None:
-                    msg = f"{cmd[1]} is not banned."
-                    self.console_log(f"{message.author}: !ban {cmd[1]} - BAD REQUEST")
-                else:
+                if q is not None:
                     session.delete(q)
-                    session.commit()
-                    msg = f"Removed {cmd[1]} from list of unbanned users."
-                    self.console_log(f"{message.author}: !ban {cmd[1]} - SUCCESS")
 
-            return await message.channel.send(msg)
+            # User wasn't banned.
+            if q is None:
+                msg = f"{username} is not banned."
+                self.console_log(f"{message.author}: !ban {username} - BAD REQUEST")
+            else:
+                self._banned.discard(username)
+                msg = f"Removed {username} from list of unbanned users."
+                self.console_log(f"{message.author}: !ban {username} - SUCCESS")
 
-        # Let the bots owner remotely kill the process.
-        if cmd[0] == "!exit" and caller_is_owner:
-            self.console_log(f"{message.author} !exit")
-            exit()
+        return await message.channel.send(msg)
+
+    async def _cmd_exit(self, message, arg):
+        """
+        Let the bots owner remotely kill the process.
+        """
+        self.console_log(f"{message.author} !exit")
+        exit()
 
     @tasks.loop(minutes=int(os.getenv("REFRESH_INTERVAL")))
     async def update_articles(self):
@@ -232,9 +365,54 @@ class SubstackBot(discord.Client):
         Fetch new Articles for every subscribed to Author.
         """
         self.console_log(f"Fetching new articles.")
-        authors = session.query(Author).all()
-        for author in authors:
-            author.update_articles()
+        authors = list(self._authors)
+
+        # Fetch every feed concurrently, then parse each in turn.
+        responses = await asyncio.gather(
+            *[
+                _fetch_feed(self.feed_session, a.feed_url(), a.etag, a.last_modified)
+                for a in authors
+            ],
+            return_exceptions=True,
+        )
+
+        # Oldest publish date to save, shared by every feed this cycle.
+        cutoff = datetime.now() - timedelta(days=self._oldest_days)
+
+        # Ignore anyone unsubscribed from while the feeds were being fetched.
+        subscribed = {a.id for a in self._authors}
+
+        with Session() as session:
+            for author, response in zip(authors, responses):
+                if author.id not in subscribed:
+                    continue
+
+                if isinstance(response, Exception):
+                    self.console_log(f"Unable to fetch feed for {author.subdomain}.")
+                    continue
+
+                # Feed is unchanged since the last fetch.
+                feed, etag, last_modified = response
+                if feed is None:
+                    continue
+
+                # Save each author in its own transaction, so one bad feed
+                # doesn't roll back the rest of the cycle.
+                try:
+                    with session.begin():
+                        author.update_articles(session, feed, cutoff)
+                        session.execute(
+                            update(Author)
+                            .where(Author.id == author.id)
+                            .values(etag=etag, last_modified=last_modified)
+                        )
+                except Exception:
+                    self.console_log(f"Unable to save articles for {author.subdomain}.")
+                    continue
+
+                # Cached authors are detached, so update them once it's saved.
+                author.etag = etag
+                author.last_modified = last_modified
 
     @tasks.loop(minutes=int(os.getenv("POST_INTERVAL")))
     async def post_articles(self):
@@ -242,15 +420,19 @@ class SubstackBot(discord.Client):
         Post all articles with "posted" set to False, then set to True.
         """
         self.console_log(f"Posting new articles.")
-        articles = session.query(Article).filter(Article.posted == false()).all()
-
-        for article in articles:
+        # Load each unposted Article along with its Author in one query.
+        with Session() as session:
+            rows = session.execute(
+                select(Article, Author)
+                .join(Author, Author.id == Article.author_id)
+                .where(Article.posted == false())
+            ).all()
 
-            # Use FK to find Author.
-            author = article.get_author()
+        sends = []
+        for article, author in rows:
 
             # Remove time from full date time string.
-            published = " ".join(article.published.split(" ")[:-2])
+            published = article.published.rsplit(" ", 2)[0]
 
             article_data = {
                 "author": author.username,
@@ -260,13 +442,41 @@ class SubstackBot(discord.Client):
                 "published": published,
             }
 
-            await self.channel_id.send(embed=new_article_message(**article_data))
+            sends.append(self.channel.send(embed=new_article_message(**article_data)))
+
+        # Send concurrently, discord.py keeps within the channel's rate limit.
+        results = await asyncio.gather(*sends, return_exceptions=True)
+
+        posted_ids = []
+        for (article, author), result in zip(rows, results):
+
+            # Leave the article unposted to retry next time if sending failed.
+            if isinstance(result, Exception):
+                self.console_log(f"Unable to post article '{article.title}'.")
+                continue
+
+            posted_ids.append(article.id)
             self.console_log(
                 f"Posted new article '{article.title}' by {author.username}."
             )
 
-            article.posted = True
-            session.commit()
+        # Mark everything that was sent as posted in one commit.
+        if posted_ids:
+            with Session.begin() as session:
+                session.execute(
+                    update(Article)
+                    .where(Article.id.in_(posted_ids))
+                    .values(posted=True)
+                    .execution_options(synchronize_session=False)
+                )
+
+    async def close(self):
+        """
+        Close the feed HTTP session along with the Discord connection.
+        """
+        if self.feed_session is not None:
+            await self.feed_session.close()
+        await super().close()
 
     @classmethod
     def console_log(cls, msg):
@@ -10,7 +10,7 @@ class Colors:
     purple = 0xF613CD
 
 
-def help_message():
+def _build_help_embed():
     """
     Bot help message.
     """
@@ -32,6 +32,10 @@ def help_message():
     return embed
 
 
+# Help message never changes, so build it once and reuse it for every send.
+HELP_EMBED = _build_help_embed()
+
+
 def new_article_message(
     author=None,
     title=None,
@@ -43,8 +47,8 @@ def new_article_message(
     Formatted new article message.
     """
     embed = discord.Embed(
-        title=f"{author}", description=f"[{title}]({article_url})", color=Colors.purple
+        title=author, description=f"[{title}]({article_url})", color=Colors.purple
     )
-    embed.set_thumbnail(url=f"{thumbnail_url}")
-    embed.set_footer(text=f"{published}")
+    embed.set_thumbnail(url=thumbnail_url)
+    embed.set_footer(text=published)
     return embed
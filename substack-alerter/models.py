@@ -1,14 +1,29 @@
 import os
 
-import feedparser
-
-from sqlalchemy import Column, Integer, Boolean, String, ForeignKey, create_engine
+from io import BytesIO
+
+from lxml import etree
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    Boolean,
+    String,
+    ForeignKey,
+    Index,
+    create_engine,
+    delete,
+    event,
+    func,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.exc import IntegrityError
-
-from datetime import datetime, timedelta
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 
-from dateutil import parser
+from email.utils import parsedate_to_datetime
 
 from dotenv import load_dotenv
 
@@ -17,10 +32,36 @@ from dotenv import load_dotenv
 load_dotenv(".env")
 
 # Set up DB.
-engine = create_engine(os.getenv("DB_URI"))
+DB_URI = os.getenv("DB_URI")
+IS_SQLITE = DB_URI.startswith("sqlite")
+
+engine_args = {}
+if IS_SQLITE:
+    engine_args["connect_args"] = {"check_same_thread": False}
+
+    # Keep file DB connections open between jobs rather than reconnecting,
+    # so pragmas and the statement cache persist across ticks.
+    if make_url(DB_URI).database not in (None, "", ":memory:"):
+        engine_args["poolclass"] = QueuePool
+
+engine = create_engine(DB_URI, **engine_args)
+
+if IS_SQLITE:
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        Use WAL so readers don't block writers, and relax fsyncs to match.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
-Session = sessionmaker(bind=engine)
-session = Session()
+
+# Keep loaded objects usable after commit, as the bot caches Authors.
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 
 Base = declarative_base(bind=engine)
 
@@ -41,13 +82,6 @@ class BannedUser(Base):
 
         self.discord_username = str(discord_username)
 
-        try:
-            session.add(self)
-            session.commit()
-        except IntegrityError as e:
-            session.rollback()
-            raise Exception("Author is already in DB.")
-
 
 class Author(Base):
     """
@@ -62,74 +96,130 @@ class Author(Base):
     subdomain = Column(String, unique=True, nullable=False)
     thumbnail = Column(String, nullable=False)
 
-    def __init__(self, subdomain=None, **kwargs):
+    # Validators from the last feed response, sent back to skip unchanged feeds.
+    etag = Column(String)
+    last_modified = Column(String)
+
+    def __init__(self, subdomain=None, feed=None, **kwargs):
         """
-        Check the author can be found before saving to DB.
+        Check the author can be found before it is saved to DB. Takes the
+        raw bytes of the author's feed, fetched by the caller.
         """
         super(Author, self).__init__(**kwargs)
 
         self.subdomain = subdomain
 
-        # Check the subdomain is valid.
-        xml_feed = self._xml_feed().feed
-        if not "title" in xml_feed:
+        # Check the subdomain is valid and has everything we store.
+        channel, _ = self._parse_feed(feed)
+        if not all(channel.get(k) for k in ("title", "copyright", "image")):
             raise ValueError(
                 f"Unable to find author '{subdomain}' on Substack."
                 f" Are you sure this is a subdomain?"
             )
 
-        self.username = xml_feed["copyright"]
-        self.thumbnail = xml_feed["image"]["href"]
+        self.username = channel["copyright"]
+        self.thumbnail = channel["image"]
 
-        try:
-            session.add(self)
-            session.commit()
-        except IntegrityError as e:
-            session.rollback()
-            raise Exception("Author is already in DB.")
-
-    def _xml_feed(self):
+    @staticmethod
+    def _parse_feed(feed):
         """
-        Return link to authors XML feed.
+        Stream-parse pre-fetched bytes of an authors RSS feed. Returns a
+        tuple of (channel, items), each holding only the fields we use.
         """
-        return feedparser.parse(f"http://{self.subdomain}.substack.com/feed")
+        channel, items = {}, []
+        if not feed:
+            return channel, items
+
+        # Never expand entities or fetch DTDs, feeds come from untrusted hosts.
+        context = etree.iterparse(
+            BytesIO(feed),
+            events=("end",),
+            tag="item",
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        )
+        try:
+            for _, elem in context:
+                items.append(
+                    {
+                        "title": elem.findtext("title"),
+                        "link": elem.findtext("link"),
+                        "published": elem.findtext("pubDate"),
+                    }
+                )
+                # Free each item as soon as it has been read.
+                elem.clear()
+
+            header = context.root.find("channel")
+        except etree.XMLSyntaxError:
+            return channel, items
+
+        if header is not None:
+            channel = {
+                "title": header.findtext("title"),
+                "copyright": header.findtext("copyright"),
+                "image": header.findtext("image/url"),
+            }
+
+        return channel, items
 
     def page_url(self):
         return f"https://{self.subdomain}.substack.com"
 
-    def update_articles(self):
+    def feed_url(self):
+        return f"{self.page_url()}/feed"
+
+    def update_articles(self, session, feed, cutoff):
         """
-        Return a list of the Author's articles.
+        Add any new articles published after cutoff found in the Author's
+        pre-fetched feed to session.
         """
-        entries = self._xml_feed()["entries"]
-
-        # Extract only articles from feed.
-        is_article = lambda a: a["published"] and a["title"] != "Coming soon"
-        articles_list = list(filter(is_article, entries))
+        _, entries = self._parse_feed(feed)
 
-        # Save all new articles into DB.
-        for a in articles_list:
+        # Collect Articles from within preferred time frame, keyed by URL.
+        new_rows = {}
+        for a in entries:
 
-            # Only save Articles from within preferred time frame.
-            published_date = parser.parse(a["published"]).replace(tzinfo=None)
-            posted_delta = datetime.now() - published_date
+            # Skip anything in the feed that isn't an article, or that has
+            # already been collected, before paying for the date parse.
+            url = a["link"]
+            if not url or url in new_rows:
+                continue
+            if not a["published"] or a["title"] == "Coming soon":
+                continue
 
-            if posted_delta.days > int(os.getenv("OLDEST_POST_DELTA")):
+            # RSS pubDates should be RFC 822, skip any that aren't.
+            try:
+                published_date = parsedate_to_datetime(a["published"])
+            except (TypeError, ValueError):
                 continue
 
-            # Check its not in the DB already.
-            q = session.query(Article).filter(Article.title == a["title"]).first()
-            if q is not None:
+            if published_date.replace(tzinfo=None) < cutoff:
                 continue
 
-            args = {
+            new_rows[url] = {
                 "title": a["title"],
-                "url": a["links"][0]["href"],
+                "url": url,
                 "published": a["published"],
                 "author_id": self.id,
+                "posted": False,
             }
 
-            article = Article(**args)
+        if not new_rows:
+            return
+
+        # Drop any already in the DB, then save the rest in one batch, so the
+        # DB is touched at most twice per feed however many entries it has.
+        existing = set(
+            session.execute(
+                select(Article.url).where(Article.url.in_(list(new_rows)))
+            ).scalars()
+        )
+        rows = [row for url, row in new_rows.items() if url not in existing]
+
+        if rows:
+            session.bulk_insert_mappings(Article, rows)
 
 
 class Article(Base):
@@ -142,33 +232,54 @@ class Article(Base):
     # Attributes:
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
-    url = Column(String, nullable=False)
+    url = Column(String, unique=True, index=True, nullable=False)
     published = Column(String, nullable=False)
     posted = Column(Boolean)
     author_id = Column(Integer, ForeignKey("authors.id"))
 
-    def __init__(self, title, url, published, author_id, **kwargs):
-        """
-        Check the author can be found before saving to DB.
-        """
-        super(Article, self).__init__(**kwargs)
+    # Keeps the unposted articles lookup cheap however large the archive gets.
+    __table_args__ = (
+        Index(
+            "ix_articles_unposted",
+            "posted",
+            "author_id",
+            sqlite_where=text("posted = 0"),
+            postgresql_where=text("posted = false"),
+        ),
+    )
 
-        self.title = title
-        self.url = url
-        self.published = published
-        self.author_id = author_id
-        self.posted = False
 
-        session.add(self)
-        session.commit()
+def migrate():
+    """
+    Create missing tables and add any columns or indexes missing from
+    existing ones, removing duplicate articles first.
+    """
+    Base.metadata.create_all()
 
-    def get_author(self):
-        """
-        Use Foreign Key to fetch Author of Article.
-        """
-        return session.query(Author).filter(Author.id == self.author_id).first()
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+
+        # Articles used to be de-duplicated by title, so older DBs can hold
+        # the same URL more than once. Keep the first before url is unique.
+        first_ids = select(func.min(Article.id)).group_by(Article.url)
+        conn.execute(delete(Article).where(Article.id.not_in(first_ids)))
+
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                    )
+                )
+
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
 
 if __name__ == "__main__":
-    # Run seperately to set up tables.
-    Base.metadata.create_all()
+    # Run seperately to set up or migrate tables.
+    migrate()